@@ -0,0 +1,148 @@
+"""Command latency with inline board publishing vs. board_publisher.py.
+
+Uses a local stand-in for Discord whose API calls just sleep, and a scripted
+burst of `finished` commands interleaved with `score` lookups.
+
+    python bench_board_publisher.py > bench_output.txt
+"""
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+from board_publisher import BoardPublisher
+from boards import publish_board
+from common import TMW_GUILD_ID
+from db import Store, init_tables
+
+API_LATENCY = 0.05
+BURST = 40
+ARRIVAL_INTERVAL = 0.02
+CLUB = 'MANGA'
+BOOK = 'MANGA1'
+
+FakeMember = namedtuple('FakeMember', ['id', 'display_name'])
+
+
+class FakeMessage:
+    async def edit(self, **kwargs):
+        await asyncio.sleep(API_LATENCY)
+
+
+class FakeChannel:
+    async def fetch_message(self, msg_id):
+        await asyncio.sleep(API_LATENCY)
+        return FakeMessage()
+
+    async def send(self, *args, **kwargs):
+        await asyncio.sleep(API_LATENCY)
+
+
+class FakeGuild:
+    def get_member(self, user_id):
+        return FakeMember(user_id, f'user{user_id}')
+
+    async def fetch_member(self, user_id):
+        await asyncio.sleep(API_LATENCY)
+        return self.get_member(user_id)
+
+
+class FakeClient:
+    def get_channel(self, channel_id):
+        return FakeChannel()
+
+    def get_user(self, user_id):
+        return FakeMember(user_id, f'user{user_id}')
+
+    async def fetch_guild(self, guild_id):
+        await asyncio.sleep(API_LATENCY)
+        return FakeGuild()
+
+
+def _make_db():
+    db_name = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    init_tables(db_name)
+    store = Store(db_name)
+    store.new_club(TMW_GUILD_ID, CLUB, CLUB)
+    store.new_book(TMW_GUILD_ID, CLUB, 'Bench manga', BOOK, 2.0, datetime(2024, 1, 1))
+    store.new_activities(TMW_GUILD_ID, CLUB, BOOK, [(user_id, 2.0) for user_id in range(1000)])
+    store.conn.close()
+    return db_name
+
+
+def _run_publisher(db_name, stop):
+    async def run():
+        publisher = BoardPublisher(FakeClient(), Store(db_name), poll_interval=0.05)
+        while not stop.is_set():
+            await publisher.publish_pending()
+            await asyncio.sleep(publisher.poll_interval)
+        await publisher.publish_pending()
+        print(f'publisher: {publisher.published} board edits')
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        asyncio.run(run())
+    print(out.getvalue().splitlines()[-1])
+
+
+async def _burst(store, client, inline):
+    channel = client.get_channel(None)
+    latencies = defaultdict(list)
+
+    async def finished(user_id):
+        start = time.perf_counter()
+        store.new_activity(TMW_GUILD_ID, user_id, CLUB, BOOK, 2.0)
+        await channel.send('finished')
+        if inline:
+            await publish_board(client, store, CLUB)
+            await publish_board(client, store, None)
+        latencies['finished'].append(time.perf_counter() - start)
+
+    async def score():
+        start = time.perf_counter()
+        store.get_scoreboard(TMW_GUILD_ID, CLUB)
+        await channel.send('score')
+        latencies['score'].append(time.perf_counter() - start)
+
+    tasks = []
+    for i in range(BURST):
+        tasks.append(asyncio.create_task(finished(10_000 + i)))
+        tasks.append(asyncio.create_task(score()))
+        await asyncio.sleep(ARRIVAL_INTERVAL)
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def _report(mode, latencies):
+    for command, values in sorted(latencies.items()):
+        values = sorted(values)
+        p95 = values[int(len(values) * 0.95) - 1]
+        print(f'{mode:>8} {command:>8}: p50 {statistics.median(values) * 1000:7.1f}ms'
+              f'  p95 {p95 * 1000:7.1f}ms  max {values[-1] * 1000:7.1f}ms')
+
+
+def bench(inline):
+    db_name = _make_db()
+    store = Store(db_name, journal_board_changes=not inline)
+    stop = multiprocessing.Event()
+    worker = None
+    if not inline:
+        worker = multiprocessing.Process(target=_run_publisher, args=(db_name, stop))
+        worker.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        latencies = asyncio.run(_burst(store, FakeClient(), inline))
+    if worker:
+        stop.set()
+        worker.join()
+    _report('inline' if inline else 'worker', latencies)
+
+
+if __name__ == '__main__':
+    print(f'{BURST} finished + {BURST} score commands, one every {ARRIVAL_INTERVAL * 1000:g}ms, '
+          f'{API_LATENCY * 1000:g}ms per Discord call')
+    bench(inline=True)
+    bench(inline=False)
@@ -0,0 +1,82 @@
+"""Publishes the club boards from a separate process.
+
+Start the bot with BOARD_PUBLISHER=external and run this alongside it. The
+bot's Store then appends to the board_changes journal instead of editing
+board messages itself, and this process polls the journal (the database is
+in WAL mode, so reads don't block the bot) and edits the stale boards.
+"""
+import asyncio
+import os
+
+import discord
+
+from boards import BOARD_CLUBS, publish_board
+from common import TMW_GUILD_ID
+from db import Store, init_tables
+
+
+class BoardPublisher:
+    def __init__(self, client, store, poll_interval=1.0):
+        self.client = client
+        self.store = store
+        self.poll_interval = poll_interval
+        self.last_id = 0
+        self.published = 0
+        self.task = None
+
+    async def publish_pending(self):
+        """Publishes every board with journal entries newer than last_id, each once."""
+        changes = self.store.get_board_changes(self.last_id)
+        if not changes:
+            return []
+
+        club_codes = set()
+        for change in changes:
+            # The writes happened in the bot process, so our cached reads are stale.
+            self.store.cache.invalidate('activities', change.discord_guild_id)
+            self.store.cache.invalidate('books', change.discord_guild_id)
+            if change.discord_guild_id == TMW_GUILD_ID:
+                club_codes.update((change.club_code, None))
+        boards = [club_code for club_code in BOARD_CLUBS if club_code in club_codes]
+
+        results = await asyncio.gather(
+            *(publish_board(self.client, self.store, club_code) for club_code in boards),
+            return_exceptions=True)
+        failed = [(club_code, result) for club_code, result in zip(boards, results) if isinstance(result, Exception)]
+        for club_code, result in failed:
+            print(f'Failed to update {club_code}: {result!r}')
+        self.published += len(boards) - len(failed)
+        if failed:
+            # Keep the journal entries so the next poll retries.
+            return boards
+
+        self.last_id = changes[-1].id
+        self.store.delete_board_changes(self.last_id)
+        return boards
+
+    async def run(self):
+        while True:
+            try:
+                await self.publish_pending()
+            except Exception as e:
+                print(f'Board publisher failed: {e!r}')
+            await asyncio.sleep(self.poll_interval)
+
+
+def main():
+    db_name = 'prod.db' if os.environ.get('ENV') == 'prod' else 'main.db'
+    init_tables(db_name)
+    client = discord.Client(intents=discord.Intents.default())
+    publisher = BoardPublisher(client, Store(db_name))
+
+    @client.event
+    async def on_ready():
+        print(f'{client.user.name} publishing boards from {db_name}')
+        if publisher.task is None:
+            publisher.task = asyncio.create_task(publisher.run())
+
+    client.run(os.environ.get('DISCORD_TOKEN', ''))
+
+
+if __name__ == '__main__':
+    main()
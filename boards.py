@@ -0,0 +1,59 @@
+"""Scoreboard messages kept up to date in the board channel.
+
+Shared by the bot, which publishes boards inline after each command, and by
+board_publisher.py, which can do it from a separate process instead.
+"""
+import discord
+
+import common
+from common import TMW_GUILD_ID, make_ordinal
+
+BOARD_CHANNEL_ID = 924744340809601094
+
+VN_BOARD = 927651314882715678
+VN2_BOARD = 1026455413975162890
+VN3_BOARD = 1108098978878333009
+VN4_BOARD = 1200062710231076974
+MANGA_BOARD = 927651315595751424
+NOVEL_BOARD = 927651316447215686
+VIDYA_BOARD = 927651317143453756
+JOSEI_BOARD = 927651317579649075
+ALL_BOARD = 927651653472092161
+
+BOARDS = {
+    'VN4': VN4_BOARD,
+    'VN3': VN3_BOARD,
+    'MANGA': MANGA_BOARD,
+    'NOVEL': NOVEL_BOARD,
+    'VIDYA': VIDYA_BOARD,
+    'JOSEI': JOSEI_BOARD,
+    None: ALL_BOARD,
+}
+BOARD_CLUBS = ['VN3', 'VN4', 'MANGA', 'NOVEL', 'VIDYA', 'JOSEI', None]
+
+
+async def publish_board(client, store, club_code):
+    """Renders the club_code board (None for the overall one) and edits its message."""
+    print(f"Updating {club_code}")
+    msg_id = BOARDS[club_code]
+
+    channel = client.get_channel(BOARD_CHANNEL_ID)
+    msg = await channel.fetch_message(msg_id)
+    guild = await client.fetch_guild(TMW_GUILD_ID)
+    leaderboard = store.get_scoreboard(TMW_GUILD_ID, club_code, limit=10)
+
+    title = f'**{club_code or "All"} Scoreboard**'
+    async def leaderboard_row(user_id, points, rank):
+        user = await common.get_member(client, guild, user_id)
+        display_name = user.display_name if user else 'Unknown'
+        return f'**{make_ordinal(rank)} {display_name}**: {common.millify(points)}pts'
+
+    leaderboard_msg = "\n".join([await leaderboard_row(user_id, pts, i+1) for i, (user_id, pts) in enumerate(leaderboard)])
+    embed = discord.Embed(title=title, description=leaderboard_msg)
+
+    content = ''
+    if club_code:
+        past_books = store.get_books(TMW_GUILD_ID, club_code, limit=50)
+        past_books_str = ', '.join(f'**{b.name}**[{b.code}]' for b in past_books)
+        content = f"Past picks: {past_books_str}"
+    await msg.edit(content=content, embed=embed)
@@ -1,7 +1,13 @@
 import os
+import asyncio
+import contextlib
+import time
+import resource
+import tracemalloc
 import csv
+import re
 import inspect
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from enum import Enum
 from collections import defaultdict
 from textwrap import dedent
@@ -11,42 +17,66 @@ import discord
 import tempfile
 import json
 import pprint
-from typing import Optional
+from typing import Literal, Optional
+from discord import app_commands
 from discord.utils import get
 
 logging.basicConfig(level=logging.INFO)
 
-from discord.ext import commands
+from discord.ext import commands, tasks
 from db import init_tables, Store
+from book_index import CatalogIndex
+from loop_watchdog import LoopWatchdog
+from boards import BOARD_CLUBS, publish_board
 import common
-from common import TMW_GUILD_ID, make_ordinal
+from common import TMW_GUILD_ID, MediaType, MEDIA_WEIGHTS, make_ordinal
+
+# MEMORY_BUDGET=low keeps only what the commands below need: guild messages for the
+# prefix, no member cache or chunking (common.get_member fetches on demand), no
+# message cache, and smaller bot-side caches.
+_MEMORY_BUDGET = os.environ.get('MEMORY_BUDGET') == 'low'
+_STORE_CACHE_BYTES = None
 
 help_command = commands.DefaultHelpCommand(no_category='Commands')
-intents = discord.Intents.default()
-intents.message_content = True
-bot = commands.Bot(command_prefix='bc! ', help_command=help_command, intents=intents)
+if _MEMORY_BUDGET:
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.messages = True
+    intents.message_content = True
+    bot_options = dict(
+        member_cache_flags=discord.MemberCacheFlags.none(),
+        max_messages=None,
+        chunk_guilds_at_startup=False,
+    )
+    common.user_cache.maxsize = 256
+    _STORE_CACHE_BYTES = 1024 * 1024
+else:
+    intents = discord.Intents.default()
+    intents.message_content = True
+    bot_options = {}
+bot = commands.Bot(command_prefix='bc! ', help_command=help_command, intents=intents, **bot_options)
 
 _ADMIN_ID = 297606972092710913
 _ADMIN_ROLE_IDS = None
 _DB_NAME = 'main.db'
 store = None
-
-
-VN_BOARD = 927651314882715678
-VN2_BOARD = 1026455413975162890
-VN3_BOARD = 1108098978878333009
-VN4_BOARD = 1200062710231076974
-MANGA_BOARD = 927651315595751424
-NOVEL_BOARD = 927651316447215686
-VIDYA_BOARD = 927651317143453756
-JOSEI_BOARD = 927651317579649075
-ALL_BOARD = 927651653472092161
+catalog = CatalogIndex()
+loop_watchdog = LoopWatchdog()
+# Set once setup_hook has finished, commands wait on it instead of seeing store = None.
+_ready = asyncio.Event()
+startup_timings = {}
+# Fingerprint of the data each board showed when it was last published.
+_board_fingerprints = {}
+# Boards are published by board_publisher.py from the change journal instead of inline.
+_EXTERNAL_PUBLISHER = False
 
 def _set_globals():
     environment = os.environ.get('ENV')
     is_prod = environment == 'prod'
     global _ADMIN_ROLE_IDS
     global _DB_NAME
+    global _EXTERNAL_PUBLISHER
+    _EXTERNAL_PUBLISHER = os.environ.get('BOARD_PUBLISHER') == 'external'
     if is_prod:
         print("Running on prod")
         _ADMIN_ROLE_IDS = [
@@ -69,21 +99,82 @@ def _set_globals():
         _DB_NAME = 'main.db'
 
 
+@contextlib.contextmanager
+def _timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[phase] = time.perf_counter() - start
+        print(f'{phase} took {startup_timings[phase]:.3f}s')
+
+
 @bot.event
-async def on_ready():
-    print(f'{bot.user.name} has connected to Discord!')
-    _set_globals()
-    print(f'Initing tables on {_DB_NAME}')
+async def setup_hook():
+    # Runs once per process, before the first gateway connection.
     global store
-    store = Store(_DB_NAME)
-    init_tables(_DB_NAME)
-    await update_info()
+    loop_watchdog.start()
+    with _timed('globals'):
+        _set_globals()
+    print(f'Initing tables on {_DB_NAME}')
+    with _timed('init_tables'):
+        init_tables(_DB_NAME)
+    with _timed('store'):
+        store = Store(_DB_NAME, cache_max_bytes=_STORE_CACHE_BYTES, journal_board_changes=_EXTERNAL_PUBLISHER)
+    with _timed('catalog'):
+        catalog.load(store)
+    _ready.set()
+    close_months_job.start()
+    # Slash commands are synced with `bc! sync`, syncing on every start gets rate limited.
     print('Done initing tables')
 
 
-@bot.command(name='new_club', help="Create a new club")
+@bot.event
+async def on_ready():
+    # Fires on every reconnect, so only boards whose data changed get refreshed.
+    print(f'{bot.user.name} has connected to Discord!')
+    await _ready.wait()
+    with _timed('boards'):
+        await update_info()
+
+
+@bot.before_invoke
+async def wait_until_initialized(ctx):
+    await _ready.wait()
+
+
+async def _check_admin(ctx):
+    """Role check for admin commands. Slash invocations get an ephemeral refusal so they are answered."""
+    if ctx.guild and common.has_role(ctx.author, _ADMIN_ROLE_IDS):
+        return True
+    if ctx.interaction:
+        await ctx.send('Only club admins can use this command.', ephemeral=True)
+    return False
+
+
+def _choice_label(entry):
+    label = f'{entry.code} - {entry.name}' if entry.name else entry.code
+    return label[:100]
+
+
+async def club_autocomplete(interaction: discord.Interaction, current: str):
+    if interaction.guild_id is None:
+        return []
+    return [app_commands.Choice(name=_choice_label(entry), value=entry.code)
+            for entry in catalog.search_clubs(interaction.guild_id, current)]
+
+
+async def book_autocomplete(interaction: discord.Interaction, current: str):
+    if interaction.guild_id is None:
+        return []
+    return [app_commands.Choice(name=_choice_label(entry), value=entry.code)
+            for entry in catalog.search_books(interaction.guild_id, current)]
+
+
+@bot.hybrid_command(name='new_club', help="Create a new club")
+@app_commands.guild_only()
 async def on_message(ctx, name: str, code: str):
-    if not common.has_role(ctx.author, _ADMIN_ROLE_IDS):
+    if not await _check_admin(ctx):
         return
 
     club = store.get_club(ctx.guild.id, code)
@@ -92,12 +183,15 @@ async def on_message(ctx, name: str, code: str):
         return
 
     store.new_club(ctx.guild.id, name, code)
+    catalog.add_club(ctx.guild.id, code, name)
     await ctx.send(f'New club "{name}" created with code {code}')
 
 
-@bot.command(name='new_book', help="Add a new book")
+@bot.hybrid_command(name='new_book', help="Add a new book")
+@app_commands.guild_only()
+@app_commands.autocomplete(club_code=club_autocomplete)
 async def on_message(ctx, club_code: str, name: str, code: str, points: float = 2.0, created_at: str = None):
-    if not common.has_role(ctx.author, _ADMIN_ROLE_IDS):
+    if not await _check_admin(ctx):
         return
 
     club_code = club_code.upper()
@@ -119,15 +213,18 @@ async def on_message(ctx, club_code: str, name: str, code: str, points: float =
         return
     print(book)
     store.new_book(ctx.guild.id, club_code, name, code, points, created_at)
+    catalog.add_book(ctx.guild.id, code, name, club_code)
 
 
     await ctx.send(f'New book "{name}" added with code {code} worth {points:g} points')
     await update_club_message(club_code)
 
 
-@bot.command(name='delete_book', help="Delete a book")
+@bot.hybrid_command(name='delete_book', help="Delete a book")
+@app_commands.guild_only()
+@app_commands.autocomplete(code=book_autocomplete)
 async def on_message(ctx, code: str):
-    if not common.has_role(ctx.author, _ADMIN_ROLE_IDS):
+    if not await _check_admin(ctx):
         return
 
     code = code.upper()
@@ -137,13 +234,16 @@ async def on_message(ctx, code: str):
         return
 
     store.delete_book(ctx.guild.id, code)
+    catalog.remove_book(ctx.guild.id, code)
     await ctx.send(f'Deleted book {code}')
     await update_club_message(book.club_code)
 
 
-@bot.command(name='finished', help="Mark someone who has finished a book")
+@bot.hybrid_command(name='finished', help="Mark someone who has finished a book")
+@app_commands.guild_only()
+@app_commands.autocomplete(book_code=book_autocomplete)
 async def on_message(ctx, member: discord.Member, book_code: str, points: float = None):
-    if not common.has_role(ctx.author, _ADMIN_ROLE_IDS):
+    if not await _check_admin(ctx):
         return
 
     discord_guild_id = ctx.guild.id
@@ -169,7 +269,72 @@ async def on_message(ctx, member: discord.Member, book_code: str, points: float
     await update_club_message(None) # Update all
 
 
-@bot.command(name='books', help='Club overview with books and associated readers')
+_USER_ID_RE = re.compile(r'<@!?(\d+)>|\b(\d{15,20})\b')
+
+
+def _parse_user_ids(text):
+    ids = []
+    for match in _USER_ID_RE.finditer(text):
+        user_id = int(match.group(1) or match.group(2))
+        if user_id not in ids:
+            ids.append(user_id)
+    return ids
+
+
+async def _query_guild_members(guild, user_ids):
+    members = {}
+    # The gateway accepts at most 100 user ids per member request.
+    for i in range(0, len(user_ids), 100):
+        for member in await guild.query_members(user_ids=user_ids[i:i + 100], limit=100):
+            members[member.id] = member
+    return members
+
+
+@bot.command(name='finished_many', help="Mark many members as having finished a book. Takes mentions/ids and/or an attached list")
+async def on_message(ctx, book_code: str, *members: str):
+    if not await _check_admin(ctx):
+        return
+
+    discord_guild_id = ctx.guild.id
+    book_code = book_code.upper()
+    book = store.get_book(discord_guild_id, book_code)
+    if not book:
+        await ctx.send(f'Unknown book code {book_code}.')
+        return
+
+    text = ' '.join(members)
+    for attachment in ctx.message.attachments:
+        text += '\n' + (await attachment.read()).decode('utf-8', errors='ignore')
+    user_ids = _parse_user_ids(text)
+    if not user_ids:
+        await ctx.send('No members given.')
+        return
+
+    guild_members = await _query_guild_members(ctx.guild, user_ids)
+    unknown = [user_id for user_id in user_ids if user_id not in guild_members]
+    finished = {act.discord_user_id for act in store.get_activities_by_book(discord_guild_id, book_code)}
+    duplicates = [user_id for user_id in user_ids if user_id in guild_members and user_id in finished]
+    new_readers = [user_id for user_id in user_ids if user_id in guild_members and user_id not in finished]
+
+    added = store.new_activities(
+        discord_guild_id, book.club_code, book_code, [(user_id, book.points) for user_id in new_readers])
+
+    embed = discord.Embed(title=f'**{book.name} [{book_code}]**')
+    embed.add_field(name='**Finished**', value=added)
+    if duplicates:
+        embed.add_field(name='**Already finished**', value=' '.join(common.mention(u) for u in duplicates)[:1024], inline=False)
+    if unknown:
+        embed.add_field(name='**Not in server**', value=' '.join(str(u) for u in unknown)[:1024], inline=False)
+    await ctx.send(f'{added} members have finished {book_code} {common.emoji("Yay")}', embed=embed)
+
+    if added:
+        boards = [club_code for club_code in BOARD_CLUBS if club_code in (book.club_code, None)]
+        await asyncio.gather(*(update_club_message(club_code) for club_code in boards))
+
+
+@bot.hybrid_command(name='books', help='Club overview with books and associated readers')
+@app_commands.guild_only()
+@app_commands.autocomplete(club_code=club_autocomplete)
 async def on_message(ctx, club_code: str):
     if ctx.author == bot.user:
         return
@@ -177,73 +342,53 @@ async def on_message(ctx, club_code: str):
     club_code = club_code.upper()
     club = store.get_club(ctx.guild.id, club_code)
     if not club:
-        return await ctx.channel.send(f"Unknown club {club_code}")
-
-    activities = store.get_activities_by_club(ctx.guild.id, club_code)
-    print(activities)
-    readers_by_book = defaultdict(list)
-    for activity in activities:
-        user_id = activity.discord_user_id
-        readers_by_book[(activity.book_name, activity.book_code, activity.created_at)].append(user_id)
+        return await ctx.send(f"Unknown club {club_code}")
 
     title = f'**{club.name}**'
     embed = discord.Embed(title=title)
-    for (book_name, book_code, created_at), readers in readers_by_book.items():
-        # readers = [await common.get_member(bot, ctx.guild, r) for r in readers]
-
-        # reader_str = ', '.join(f'{r.display_name}' for r in readers if r)
-        if readers:
-            reader_str = f'{len(readers)} members'
+    for book in store.get_book_reader_counts(ctx.guild.id, club_code):
+        if book.readers:
+            reader_str = f'{book.readers} members'
         else:
             reader_str = 'No members'
         embed.add_field(
-            name=f'**{book_name} [{book_code}]({format_created_at(created_at)})**', value=reader_str, inline=False)
+            name=f'**{book.book_name} [{book.book_code}]({format_created_at(book.created_at)})**', value=reader_str, inline=False)
 
-    await ctx.channel.send(embed=embed)
+    await ctx.send(embed=embed)
 
 
-@bot.command(name='users', help='Users overview. Shows users and their book list')
+@bot.hybrid_command(name='users', help='Users overview. Shows users and their book list')
+@app_commands.guild_only()
+@app_commands.autocomplete(club_code=club_autocomplete)
 async def on_message(ctx, club_code: str):
     if ctx.author == bot.user:
         return
 
     club = store.get_club(ctx.guild.id, club_code)
     if not club:
-        await ctx.channel.send(f"Unknown club {club_code}")
+        await ctx.send(f"Unknown club {club_code}")
 
-    activities = store.get_activities_by_club(ctx.guild.id, club_code)
-
-
-    books_by_user = defaultdict(list)
-    for activity in activities:
-        books_by_user[activity.discord_user_id].append((activity.book_code, activity.points))
-
-    def sum_book_points(book_points):
-        return sum(pts for _, pts in book_points)
-
-    books_by_user = dict(sorted(books_by_user.items(),
-                                key=lambda item: sum_book_points(item[1]), reverse=True))
+    user_totals = store.get_club_user_totals(ctx.guild.id, club_code)
 
     title = f'**{club.name}**'
-    def book_points_to_str(book_points):
-        book_list = ', '.join(f'{code}({points:g})' for code, points in book_points)
-        total_points = sum(points for _, points in book_points)
-        return f'{book_list}: **{total_points:g} pts**'
-
-
-    description = "\n".join(f'<@!{user}>: {book_points_to_str(books)}' for user, books in books_by_user.items())
+    lines = [f'<@!{row.discord_user_id}>: {row.books}: **{row.points:g} pts**' for row in user_totals]
+    # Drop the lowest ranked users that don't fit in the embed description.
+    while len("\n".join(lines)) > 4096:
+        lines.pop()
+    description = "\n".join(lines)
     embed = discord.Embed(title=title, description=description)
-    await ctx.channel.send(embed=embed)
+    await ctx.send(embed=embed)
 
 
-@bot.command(name='user', help='Single user overview.')
+@bot.hybrid_command(name='user', help='Single user overview.')
+@app_commands.guild_only()
 async def on_message(ctx, discord_user_id: str):
     if ctx.author == bot.user:
         return
 
     activities = store.get_activities_by_user(ctx.guild.id, discord_user_id)
     if not activities:
-        await ctx.channel.send(f"No activities for {discord_user_id}")
+        await ctx.send(f"No activities for {discord_user_id}")
         return
 
     books_by_club = defaultdict(list)
@@ -263,10 +408,12 @@ async def on_message(ctx, discord_user_id: str):
         books_str = '\n'.join(f'{book_code}: {str(points) + " [partial]" if points < book_points else str(points) + " [extra]" if points > book_points else book_points}' for book_code, points, book_points in books)
         embed.add_field(name=f'**{club_code}**', value=books_str)
 
-    await ctx.channel.send(embed=embed)
+    await ctx.send(embed=embed)
 
 
-@bot.command(name='score', help='Show scoreboard')
+@bot.hybrid_command(name='score', help='Show scoreboard')
+@app_commands.guild_only()
+@app_commands.autocomplete(club_code=club_autocomplete)
 async def on_message(ctx, club_code: str = None):
     if ctx.author == bot.user:
         return
@@ -277,14 +424,16 @@ async def on_message(ctx, club_code: str = None):
     else:
         club_name = ctx.guild.name
 
-    leaderboard = store.get_scoreboard(ctx.guild.id, club_code)
+    leaderboard = store.get_scoreboard(ctx.guild.id, club_code, limit=20)
     title = f'**{club_name} Scoreboard**'
-    leaderboard_msg = "\n".join([f'<@!{user_id}>: {points:g} pts' for user_id, points in leaderboard[:20]])
+    leaderboard_msg = "\n".join([f'<@!{user_id}>: {points:g} pts' for user_id, points in leaderboard])
     embed = discord.Embed(title=title, description=leaderboard_msg)
-    await ctx.channel.send(embed=embed)
+    await ctx.send(embed=embed)
 
 
-@bot.command(name='book', help="Show book info and who has read it")
+@bot.hybrid_command(name='book', help="Show book info and who has read it")
+@app_commands.guild_only()
+@app_commands.autocomplete(book_code=book_autocomplete)
 async def on_message(ctx, book_code: str):
     if ctx.author == bot.user:
         return
@@ -304,59 +453,287 @@ async def on_message(ctx, book_code: str):
     embed.add_field(name='**Month**', value=format_created_at(book.created_at))
     embed.add_field(name='**Readers**', value=len(activities))
     embed.add_field(name='**Users**', value=users, inline=False)
-    await ctx.channel.send(embed=embed)
+    await ctx.send(embed=embed)
 
 
-def format_created_at(created_at):
-    return created_at.strftime('%b %Y')
+@bot.hybrid_command(name='undo', help='Remove your latest log entries')
+@app_commands.guild_only()
+async def on_message(ctx, count: int = 1):
+    if ctx.author == bot.user:
+        return
+    if count < 1:
+        await ctx.send('Nothing to undo.')
+        return
 
+    deleted = store.delete_latest(ctx.guild.id, ctx.author.id, count)
+    if not deleted:
+        await ctx.send('You have no logs to undo.')
+        return
+    await ctx.send(f'Removed your latest {deleted} log{"s" if deleted != 1 else ""}.')
 
 
-async def update_info():
-    await update_club_message('VN3')
-    await update_club_message('VN4')
-    await update_club_message('MANGA')
-    await update_club_message('NOVEL')
-    await update_club_message('VIDYA')
-    await update_club_message('JOSEI')
-    await update_club_message(None)
-async def update_club_message(club_code):
-    print(f"Updating {club_code}")
-    info = {
-        'VN4': VN4_BOARD,
-        'VN3': VN3_BOARD,
-        'MANGA': MANGA_BOARD,
-        'NOVEL': NOVEL_BOARD,
-        'VIDYA': VIDYA_BOARD,
-        'JOSEI': JOSEI_BOARD,
-        None: ALL_BOARD,
+# A prefix command so it works before the slash commands were ever synced.
+@bot.command(name='sync', help='Sync slash commands with Discord, run after adding or changing commands')
+async def on_message(ctx):
+    if not await _check_admin(ctx):
+        return
+
+    try:
+        synced = await bot.tree.sync()
+    except discord.HTTPException as e:
+        logging.exception('Syncing slash commands failed: %s', e)
+        await ctx.send(f'Syncing slash commands failed: {e}')
+        return
+    await ctx.send(f'Synced {len(synced)} slash commands.')
+
+
+@bot.hybrid_command(name='cache_stats', help='Show query cache counters')
+@app_commands.guild_only()
+async def on_message(ctx):
+    if not await _check_admin(ctx):
+        return
+
+    stats = store.cache.stats()
+    description = "\n".join(f'**{name}**: {value:,}' for name, value in stats.items())
+    embed = discord.Embed(title='**Query cache**', description=description)
+    await ctx.send(embed=embed)
+
+
+@bot.hybrid_command(name='lag', help='Show event loop lag and recent blocking calls')
+@app_commands.guild_only()
+async def on_message(ctx):
+    if not await _check_admin(ctx):
+        return
+
+    stats = loop_watchdog.stats()
+    embed = discord.Embed(title='**Event loop**')
+    embed.add_field(name='**Max lag**', value=f"{stats['max_lag']:.3f}s")
+    embed.add_field(name='**Avg lag**', value=f"{stats['avg_lag'] * 1000:.1f}ms")
+    embed.add_field(name='**Incidents**', value=stats['incidents'])
+    for incident in list(loop_watchdog.incidents)[-5:]:
+        stack = '\n'.join(f'`{frame}`' for frame in reversed(incident.stack))
+        embed.add_field(
+            name=f"**{incident.started_at:%Y-%m-%d %H:%M:%S} blocked {incident.lag:.3f}s**",
+            value=stack[:1024], inline=False)
+    await ctx.send(embed=embed)
+
+
+def _cache_sizes():
+    clubs, books = catalog.counts()
+    query_cache = store.cache.stats()
+    return {
+        'user_cache': f'{len(common.user_cache)}/{common.user_cache.maxsize}',
+        'query_cache': f"{query_cache['entries']} entries, {query_cache['bytes'] / 1024:.0f}/{query_cache['max_bytes'] / 1024:.0f} KiB",
+        'catalog': f'{clubs} clubs, {books} books',
+        'discord_users': len(bot.users),
+        'discord_members': sum(len(guild.members) for guild in bot.guilds),
+        'discord_messages': len(bot.cached_messages),
+        'lag_incidents': len(loop_watchdog.incidents),
     }
-    msg_id = info[club_code]
 
-    channel = bot.get_channel(924744340809601094)
-    #for _ in range(1):
-     #   await channel.send(embed=discord.Embed(title='placeholder'))
-      #  return
 
-    msg = await channel.fetch_message(msg_id)
-    guild = await bot.fetch_guild(TMW_GUILD_ID)
-    leaderboard = store.get_scoreboard(TMW_GUILD_ID, club_code)
+@bot.hybrid_command(name='memory', help='Show cache sizes and top allocations (action: report, stop)')
+@app_commands.guild_only()
+async def on_message(ctx, action: str = 'report'):
+    if not await _check_admin(ctx):
+        return
 
-    title = f'**{club_code or "All"} Scoreboard**'
-    async def leaderboard_row(user_id, points, rank):
-        user = await common.get_member(bot, guild, user_id)
-        display_name = user.display_name if user else 'Unknown'
-        return f'**{make_ordinal(rank)} {display_name}**: {common.millify(points)}pts'
+    if action == 'stop':
+        tracemalloc.stop()
+        await ctx.send('Stopped tracing allocations.')
+        return
 
-    leaderboard_msg = "\n".join([await leaderboard_row(user_id, pts, i+1) for i, (user_id, pts) in enumerate(leaderboard[:10])])
-    embed = discord.Embed(title=title, description=leaderboard_msg)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    embed = discord.Embed(title=f'**Memory** (peak RSS {peak_rss:.1f} MiB, budget mode {"on" if _MEMORY_BUDGET else "off"})')
+    sizes = _cache_sizes()
+    embed.add_field(name='**Caches**', value='\n'.join(f'{name}: {size}' for name, size in sizes.items()), inline=False)
 
-    content = ''
-    if club_code:
-        past_books = store.get_books(TMW_GUILD_ID, club_code)
-        past_books_str = ', '.join(f'**{b.name}**[{b.code}]' for b in past_books[:50])
-        content = f"Past picks: {past_books_str}"
-    await msg.edit(content=content, embed=embed)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        embed.add_field(name='**Top allocations**', value='Started tracing, run again for a report.', inline=False)
+        await ctx.send(embed=embed)
+        return
+
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ))
+    top = snapshot.statistics('lineno')[:10]
+    lines = [
+        f'`{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}` {stat.size / 1024:.1f} KiB in {stat.count}'
+        for stat in top
+    ]
+    embed.add_field(
+        name=f'**Top allocations** (traced {current / 1024 / 1024:.1f} MiB, peak {peak / 1024 / 1024:.1f} MiB)',
+        value='\n'.join(lines)[:1024] or 'Nothing traced', inline=False)
+    await ctx.send(embed=embed)
+
+
+def _current_month():
+    # UTC, like the date('now') the live leaderboard queries use.
+    now = datetime.now(timezone.utc)
+    return now.year, now.month
+
+
+@tasks.loop(hours=1)
+async def close_months_job():
+    # The only writer of snapshots. Also backfills every month since a guild's first log or book.
+    current_year, current_month = _current_month()
+    for discord_guild_id in store.get_snapshot_guild_ids():
+        for year, month in store.get_unclosed_months(discord_guild_id, current_year, current_month):
+            store.snapshot_month(discord_guild_id, year, month)
+            print(f'Closed {year}-{month:02d} leaderboards for {discord_guild_id}')
+            await asyncio.sleep(0)
+
+
+@bot.hybrid_command(name='leaderboard', description='Leaderboard for a month, by media type or club', help='Leaderboard for a month (YYYY-MM). kind media: scope is ALL or a media type, kind club: scope is a club code')
+@app_commands.guild_only()
+async def on_message(ctx, month: str, scope: str = 'ALL', kind: Literal['media', 'club'] = 'media'):
+    if ctx.author == bot.user:
+        return
+
+    try:
+        month_start = datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        await ctx.send(f'Invalid month {month}, expected YYYY-MM.')
+        return
+    scope = scope.upper()
+    # Scopes like MANGA and VN are both a media type and a club, so kind is never guessed.
+    if kind == 'media' and scope != 'ALL' and scope not in MediaType.__members__:
+        await ctx.send(f'Unknown media type {scope}, for a club use kind club.')
+        return
+    year, month_num = month_start.year, month_start.month
+
+    if (year, month_num) > _current_month():
+        await ctx.send(f'{month} has not started yet.')
+        return
+    month_key = month_start.strftime('%Y-%m')
+    if store.is_month_closed(ctx.guild.id, month_key):
+        leaderboard = store.get_snapshot_leaderboard(ctx.guild.id, month_key, kind, scope)
+    else:
+        # The current month, or a past one close_months_job hasn't reached yet.
+        leaderboard = store.get_live_month_leaderboard(ctx.guild.id, year, month_num, kind, scope)
+
+    title = f'**{scope} {"Club " if kind == "club" else ""}Leaderboard {format_created_at(month_start)}**'
+    leaderboard_msg = "\n".join(
+        f'**{make_ordinal(row.rank)}** <@!{row.discord_user_id}>: {common.millify(row.total)} pts' for row in leaderboard)
+    embed = discord.Embed(title=title, description=leaderboard_msg or 'No entries')
+    await ctx.send(embed=embed)
+
+
+def _parse_weights(weights):
+    """Parses `BOOK=1,MANGA=0.5`, media types left out don't score."""
+    parsed = {}
+    for item in weights.split(','):
+        name, _, weight = item.partition('=')
+        parsed[MediaType[name.strip().upper()]] = float(weight)
+    return parsed
+
+
+@bot.hybrid_command(name='season_create', description='Create a reading season', help='Create a reading season: name, start and end (YYYY-MM-DD, inclusive), optional weights like BOOK=1,MANGA=0.5')
+@app_commands.guild_only()
+async def on_message(ctx, name: str, start: str, end: str, weights: str = None):
+    if not await _check_admin(ctx):
+        return
+
+    try:
+        starts_at = datetime.strptime(start, '%Y-%m-%d')
+        ends_at = datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1)
+    except ValueError:
+        await ctx.send('Dates must be YYYY-MM-DD.')
+        return
+    if ends_at <= starts_at:
+        await ctx.send('A season has to end after it starts.')
+        return
+    try:
+        season_weights = _parse_weights(weights) if weights else dict(MEDIA_WEIGHTS)
+    except (KeyError, ValueError):
+        await ctx.send(f'Invalid weights {weights}, expected e.g. BOOK=1,MANGA=0.5 with types {", ".join(MediaType.__members__)}.')
+        return
 
-bot.run('')
+    season_id = store.new_season(ctx.guild.id, name, starts_at, ends_at, season_weights)
+    weights_str = ', '.join(f'{media_type.value}={weight:g}' for media_type, weight in season_weights.items())
+    await ctx.send(f'Season "{name}" [{season_id}] runs {start} to {end} with weights {weights_str}')
+
+
+@bot.hybrid_command(name='seasons', help='List reading seasons')
+@app_commands.guild_only()
+async def on_message(ctx):
+    if ctx.author == bot.user:
+        return
+
+    seasons = store.get_seasons(ctx.guild.id)
+    description = "\n".join(
+        f'[{s.id}] **{s.name}**: {s.starts_at:%Y-%m-%d} to {s.ends_at - timedelta(days=1):%Y-%m-%d}' for s in seasons[:20])
+    embed = discord.Embed(title='**Seasons**', description=description or 'No seasons yet')
+    await ctx.send(embed=embed)
+
+
+@bot.hybrid_command(name='season_join', help='Join a reading season by id')
+@app_commands.guild_only()
+async def on_message(ctx, season_id: int):
+    if ctx.author == bot.user:
+        return
+
+    season = store.get_season(ctx.guild.id, season_id)
+    if not season:
+        await ctx.send(f'Unknown season {season_id}.')
+        return
+    if season.ends_at <= datetime.now():
+        await ctx.send(f'{season.name} is already over.')
+        return
+
+    if not store.join_season(ctx.guild.id, season_id, ctx.author.id):
+        await ctx.send(f'You already joined {season.name}.')
+        return
+    await ctx.send(f'{ctx.author.mention} joined {season.name} {common.emoji("Yay")}')
+
+
+@bot.hybrid_command(name='season_standings', help='Show the standings of a reading season')
+@app_commands.guild_only()
+async def on_message(ctx, season_id: int):
+    if ctx.author == bot.user:
+        return
+
+    season = store.get_season(ctx.guild.id, season_id)
+    if not season:
+        await ctx.send(f'Unknown season {season_id}.')
+        return
+
+    standings = store.get_season_standings(ctx.guild.id, season_id)
+    title = f'**{season.name} Standings**'
+    standings_msg = "\n".join(
+        f'**{make_ordinal(row.rank)}** <@!{row.discord_user_id}>: {common.millify(row.total)} pts' for row in standings)
+    embed = discord.Embed(title=title, description=standings_msg or 'No members yet')
+    await ctx.send(embed=embed)
+
+
+def format_created_at(created_at):
+    return created_at.strftime('%b %Y')
+
+
+
+async def update_info(only_changed=True):
+    if _EXTERNAL_PUBLISHER:
+        return
+    club_codes = [
+        club_code for club_code in BOARD_CLUBS
+        if not only_changed
+        or _board_fingerprints.get(club_code) != store.get_board_fingerprint(TMW_GUILD_ID, club_code)
+    ]
+    print(f'Refreshing boards {club_codes}')
+    results = await asyncio.gather(
+        *(update_club_message(club_code) for club_code in club_codes), return_exceptions=True)
+    for club_code, result in zip(club_codes, results):
+        if isinstance(result, Exception):
+            print(f'Failed to update {club_code}: {result!r}')
+
+
+async def update_club_message(club_code):
+    if _EXTERNAL_PUBLISHER:
+        return
+    fingerprint = store.get_board_fingerprint(TMW_GUILD_ID, club_code)
+    await publish_board(bot, store, club_code)
+    _board_fingerprints[club_code] = fingerprint
 
+bot.run('')
\ No newline at end of file
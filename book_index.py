@@ -0,0 +1,136 @@
+"""In-memory prefix and substring index over clubs and books.
+
+Slash command autocomplete has to answer within Discord's 3 second window,
+so lookups are served from here instead of hitting sqlite on every keystroke.
+"""
+import bisect
+import itertools
+from collections import defaultdict, namedtuple
+
+MAX_CHOICES = 25
+NGRAM_SIZE = 3
+
+Entry = namedtuple('Entry', ['code', 'name', 'club_code'])
+
+
+def _normalize(s):
+    return (s or '').casefold().strip()
+
+
+def _ngrams(term):
+    return {term[i:i + NGRAM_SIZE] for i in range(len(term) - NGRAM_SIZE + 1)}
+
+
+class TermIndex:
+    """Maps search terms to entry codes.
+
+    Prefix lookups bisect a sorted list of (term, code) pairs, substring lookups
+    intersect trigram posting sets and then verify the candidates.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self._terms = []
+        self._grams = defaultdict(set)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _terms_for(self, entry):
+        return {_normalize(entry.code), _normalize(entry.name)} - {''}
+
+    def add(self, entry):
+        if entry.code in self.entries:
+            self.remove(entry.code)
+        self.entries[entry.code] = entry
+        for term in self._terms_for(entry):
+            bisect.insort(self._terms, (term, entry.code))
+            for gram in _ngrams(term):
+                self._grams[gram].add(entry.code)
+
+    def remove(self, code):
+        entry = self.entries.pop(code, None)
+        if entry is None:
+            return
+        for term in self._terms_for(entry):
+            i = bisect.bisect_left(self._terms, (term, code))
+            if i < len(self._terms) and self._terms[i] == (term, code):
+                del self._terms[i]
+            for gram in _ngrams(term):
+                codes = self._grams.get(gram)
+                if codes is not None:
+                    codes.discard(code)
+                    if not codes:
+                        del self._grams[gram]
+
+    def _prefix(self, query):
+        i = bisect.bisect_left(self._terms, (query,))
+        while i < len(self._terms) and self._terms[i][0].startswith(query):
+            yield self._terms[i][1]
+            i += 1
+
+    def _substring(self, query):
+        grams = _ngrams(query)
+        if not grams:
+            return []
+        candidates = set.intersection(*(self._grams.get(g, set()) for g in grams))
+        return sorted(
+            code for code in candidates
+            if any(query in term for term in self._terms_for(self.entries[code])))
+
+    def search(self, query, limit=MAX_CHOICES, predicate=None):
+        query = _normalize(query)
+        if query:
+            codes = itertools.chain(self._prefix(query), self._substring(query))
+        else:
+            codes = (code for _, code in self._terms)
+        results = []
+        seen = set()
+        for code in codes:
+            if code in seen:
+                continue
+            seen.add(code)
+            entry = self.entries[code]
+            if predicate and not predicate(entry):
+                continue
+            results.append(entry)
+            if len(results) >= limit:
+                break
+        return results
+
+
+class CatalogIndex:
+    """Per guild club and book indexes, kept in sync by the commands that write them."""
+
+    def __init__(self):
+        self._clubs = defaultdict(TermIndex)
+        self._books = defaultdict(TermIndex)
+
+    def load(self, store):
+        self._clubs.clear()
+        self._books.clear()
+        for club in store.get_all_clubs():
+            self.add_club(club.discord_guild_id, club.code, club.name)
+        for book in store.get_all_books():
+            self.add_book(book.discord_guild_id, book.code, book.name, book.club_code)
+
+    def counts(self):
+        """Number of indexed (clubs, books) across guilds."""
+        return (sum(len(index) for index in self._clubs.values()),
+                sum(len(index) for index in self._books.values()))
+
+    def add_club(self, discord_guild_id, code, name):
+        self._clubs[discord_guild_id].add(Entry(code, name, None))
+
+    def add_book(self, discord_guild_id, code, name, club_code):
+        self._books[discord_guild_id].add(Entry(code, name, club_code))
+
+    def remove_book(self, discord_guild_id, code):
+        self._books[discord_guild_id].remove(code)
+
+    def search_clubs(self, discord_guild_id, query, limit=MAX_CHOICES):
+        return self._clubs[discord_guild_id].search(query, limit)
+
+    def search_books(self, discord_guild_id, query, club_code=None, limit=MAX_CHOICES):
+        predicate = (lambda e: e.club_code == club_code) if club_code else None
+        return self._books[discord_guild_id].search(query, limit, predicate)
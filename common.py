@@ -1,4 +1,5 @@
 import asyncio
+from collections import OrderedDict
 import discord
 from enum import Enum
 import random
@@ -22,6 +23,18 @@ class MediaType(SqliteEnum):
     LISTENING = 'LISTENING'
 
 
+# Points per logged unit of each media type.
+MEDIA_WEIGHTS = {
+    MediaType.BOOK: 1.0,
+    MediaType.MANGA: 0.2,
+    MediaType.VN: 1.0 / 350.0,
+    MediaType.ANIME: 9.5,
+    MediaType.READING: 1.0 / 350.0,
+    MediaType.READTIME: 0.45,
+    MediaType.LISTENING: 0.45,
+}
+
+
 def has_role(user, valid_roles):
     return any(r.id in valid_roles for r in user.roles)
 
@@ -103,7 +116,28 @@ def mention(user_id):
     return f'<@!{user_id}>'
 
 
-user_cache = {}
+class LRUDict(OrderedDict):
+    """Dict that drops its least recently used keys beyond maxsize."""
+
+    def __init__(self, maxsize=None):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if self.maxsize is not None:
+            while len(self) > self.maxsize:
+                self.popitem(last=False)
+
+
+USER_CACHE_SIZE = 2048
+user_cache = LRUDict(USER_CACHE_SIZE)
 async def get_member(bot, guild, user_id):
     get_method = guild.get_member if guild else bot.get_user
     fetch_method = guild.fetch_member if guild else bot.fetch_user
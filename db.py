@@ -4,7 +4,9 @@ from collections import namedtuple
 import sqlite3
 
 import discord
-from common import MediaType
+import common
+from common import MediaType, MEDIA_WEIGHTS
+from query_cache import QueryCache, cached, invalidates
 
 # environment = os.environ['ENV']
 # is_prod = environment == 'PROD'
@@ -21,17 +23,72 @@ def namedtuple_factory(cursor, row):
     return res
 
 
+def weighted_amount_sql(weights):
+    """SQL expression scoring a logs row's amount with {MediaType: points per unit}."""
+    cases = '\n'.join(
+        f"WHEN media_type = '{media_type.value}' THEN amount * {float(weight)!r}"
+        for media_type, weight in weights.items())
+    return f"CASE\n{cases}\nELSE 0\nEND"
+
+
+def month_range(year, month):
+    """'YYYY-MM' key and the [start, end) created_at bounds of a calendar month."""
+    next_year, next_month = divmod(12 * year + month, 12)
+    return (f'{year:04d}-{month:02d}',
+            f'{year:04d}-{month:02d}-01',
+            f'{next_year:04d}-{next_month + 1:02d}-01')
+
+
+# Per (guild, start, end) totals a month's standings are ranked from, one row per scope and user.
+_STANDINGS_SOURCES = [
+    ('media', f"""
+        SELECT media_type AS scope, discord_user_id, SUM({weighted_amount_sql(MEDIA_WEIGHTS)}) AS total
+        FROM logs
+        WHERE discord_guild_id=? AND created_at >= ? AND created_at < ?
+        GROUP BY media_type, discord_user_id
+    """),
+    ('media', f"""
+        SELECT 'ALL' AS scope, discord_user_id, SUM({weighted_amount_sql(MEDIA_WEIGHTS)}) AS total
+        FROM logs
+        WHERE discord_guild_id=? AND created_at >= ? AND created_at < ?
+        GROUP BY discord_user_id
+    """),
+    # Club points count towards the month of the book's pick.
+    ('club', """
+        SELECT activities.club_code AS scope, activities.discord_user_id, SUM(activities.points) AS total
+        FROM activities, books
+        WHERE activities.discord_guild_id=?
+            AND activities.discord_guild_id = books.discord_guild_id
+            AND activities.book_code = books.code
+            AND books.created_at >= ? AND books.created_at < ?
+        GROUP BY activities.club_code, activities.discord_user_id
+    """),
+]
+
+
+def _ranked(source):
+    return f"""
+    SELECT scope, discord_user_id, total, RANK() OVER (PARTITION BY scope ORDER BY total DESC) AS rank
+    FROM ({source})
+    """
+
+
 class Store:
-    def __init__(self, db_name):
+    def __init__(self, db_name, cache_max_bytes=None, journal_board_changes=False):
         self.conn = sqlite3.connect(
             db_name, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
         self.conn.row_factory = namedtuple_factory
+        # Only needed when board_publisher.py is running, otherwise nothing drains the journal.
+        self.journal_board_changes = journal_board_changes
+        self.cache = QueryCache(cache_max_bytes) if cache_max_bytes else QueryCache()
 
+    @invalidates('clubs')
     def new_club(self, discord_guild_id, name, code):
         query = 'INSERT INTO clubs (discord_guild_id, code, name) VALUES (?,?,?);'
         with self.conn:
             self.conn.execute(query, (discord_guild_id, code, name))
 
+    @invalidates('books')
     def new_book(
         self, discord_guild_id, club_code, name, book_code, points, created_at
     ):
@@ -42,7 +99,9 @@ class Store:
             """
             data = (discord_guild_id, name, club_code, book_code, points, created_at)
             self.conn.execute(query, data)
-            
+            self._journal_board_change(discord_guild_id, club_code)
+
+    @invalidates('activities')
     def new_activity(
         self, discord_guild_id, discord_user_id, club_code, book_code, points
     ):
@@ -53,7 +112,24 @@ class Store:
             """
             data = (discord_guild_id, discord_user_id, club_code, book_code, points)
             self.conn.execute(query, data)
+            self._journal_board_change(discord_guild_id, club_code)
 
+    @invalidates('activities')
+    def new_activities(self, discord_guild_id, club_code, book_code, user_points):
+        """Inserts (discord_user_id, points) pairs in one transaction, skipping existing ones."""
+        with self.conn:
+            query = """
+            INSERT OR IGNORE INTO activities (discord_guild_id, discord_user_id, club_code, book_code, points)
+            VALUES (?,?,?,?,?);
+            """
+            data = [(discord_guild_id, discord_user_id, club_code, book_code, points)
+                    for discord_user_id, points in user_points]
+            added = self.conn.executemany(query, data).rowcount
+            if added:
+                self._journal_board_change(discord_guild_id, club_code)
+            return added
+
+    @invalidates('logs', 'season_standings')
     def new_log(
         self, discord_guild_id, discord_user_id, media_type, amount, note, created_at
     ):
@@ -65,6 +141,22 @@ class Store:
             data = (discord_guild_id, discord_user_id, media_type.value, amount, note, created_at)
             self.conn.execute(query, data)
 
+            # Add the weighted amount to every season the user joined whose window holds the log.
+            query = """
+            INSERT INTO season_standings (season_id, discord_user_id, total)
+            SELECT seasons.id, season_members.discord_user_id, ? * season_weights.weight
+            FROM seasons
+            JOIN season_members
+                ON season_members.season_id = seasons.id AND season_members.discord_user_id = ?
+            JOIN season_weights
+                ON season_weights.season_id = seasons.id AND season_weights.media_type = ?
+            WHERE seasons.discord_guild_id = ? AND seasons.starts_at <= ? AND seasons.ends_at > ?
+            ON CONFLICT (season_id, discord_user_id) DO UPDATE SET total = total + excluded.total;
+            """
+            data = (amount, discord_user_id, media_type.value, discord_guild_id, created_at, created_at)
+            self.conn.execute(query, data)
+
+    @cached('logs')
     def get_logs_by_user(self, discord_guild_id, discord_user_id):
         query = """
         SELECT * FROM logs
@@ -87,6 +179,8 @@ class Store:
         cursor.execute(query, data)
         return cursor.fetchall()
 
+    # Not guild scoped, and 'now' moves on, so entries also expire.
+    @cached('logs', guild_scoped=False, ttl=60)
     def get_leaderboard(self, discord_user_id, timeframe, media_type):
         where_clauses = []
         # timeframe
@@ -104,18 +198,7 @@ class Store:
         WITH scoreboard AS (
             SELECT
                 discord_user_id,
-                SUM(
-                CASE
-                    WHEN media_type = 'BOOK' THEN amount
-                    WHEN media_type = 'MANGA' THEN amount * 0.2
-                    WHEN media_type = 'VN' THEN amount * (1.0 / 350.0)
-                    WHEN media_type = 'ANIME' THEN amount * 9.5
-                    WHEN media_type = 'READING' THEN amount * (1.0 / 350.0)
-                    WHEN media_type = 'READTIME' THEN amount * 0.45
-                    WHEN media_type = 'LISTENING' THEN amount * 0.45
-                    ELSE 0
-                END
-                ) AS total
+                SUM({weighted_amount_sql(MEDIA_WEIGHTS)}) AS total
             FROM logs
             {where_clause}
             GROUP BY discord_user_id
@@ -175,24 +258,54 @@ class Store:
         cursor.execute(query, data)
         return cursor.fetchall()
 
-    def delete_latest(self, discord_guild_id, discord_user_id):
+    @invalidates('logs', 'season_standings')
+    def delete_latest(self, discord_guild_id, discord_user_id, count=1):
+        """Deletes the user's `count` most recent logs by id, walking logs_user_idx backwards."""
         with self.conn:
+            query = """
+            WITH deleted AS (
+                SELECT media_type, amount, created_at FROM logs
+                WHERE discord_guild_id=? AND discord_user_id=?
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            )
+            UPDATE season_standings SET total = total - (
+                SELECT TOTAL(deleted.amount * season_weights.weight)
+                FROM deleted
+                JOIN seasons
+                    ON seasons.id = season_standings.season_id
+                    AND seasons.starts_at <= deleted.created_at AND seasons.ends_at > deleted.created_at
+                JOIN season_weights
+                    ON season_weights.season_id = seasons.id AND season_weights.media_type = deleted.media_type
+            )
+            WHERE discord_user_id=?
+                AND season_id IN (SELECT id FROM seasons WHERE discord_guild_id=?);
+            """
+            data = (discord_guild_id, discord_user_id, count, discord_user_id, discord_guild_id)
+            self.conn.execute(query, data)
+
             query = """
             DELETE FROM logs
-            WHERE discord_guild_id=? AND discord_user_id=?
-            AND created_at=(
-                SELECT created_at FROM logs
-                WHERE discord_guild_id= ? AND discord_user_id=?
-                ORDER BY created_at DESC
-                LIMIT 1
+            WHERE id IN (
+                SELECT id FROM logs
+                WHERE discord_guild_id=? AND discord_user_id=?
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
             );
             """
-            data = (discord_guild_id, discord_user_id,
-                    discord_guild_id, discord_user_id)
+            data = (discord_guild_id, discord_user_id, count)
             return self.conn.execute(query, data).rowcount
 
+    @invalidates('logs', 'season_standings')
     def delete_user_logs(self, discord_guild_id, discord_user_id):
         with self.conn:
+            query = """
+            UPDATE season_standings SET total = 0
+            WHERE discord_user_id=?
+                AND season_id IN (SELECT id FROM seasons WHERE discord_guild_id=?);
+            """
+            self.conn.execute(query, (discord_user_id, discord_guild_id))
+
             query = """
             DELETE FROM logs
             WHERE discord_guild_id=? AND discord_user_id=?;
@@ -200,6 +313,72 @@ class Store:
             data = (discord_guild_id, discord_user_id)
             return self.conn.execute(query, data).rowcount
 
+    @invalidates('seasons')
+    def new_season(self, discord_guild_id, name, starts_at, ends_at, weights):
+        """Creates a season over [starts_at, ends_at) scoring logs with {MediaType: weight}."""
+        with self.conn:
+            query = """
+            INSERT INTO seasons (discord_guild_id, name, starts_at, ends_at)
+            VALUES (?,?,?,?);
+            """
+            season_id = self.conn.execute(query, (discord_guild_id, name, starts_at, ends_at)).lastrowid
+            query = "INSERT INTO season_weights (season_id, media_type, weight) VALUES (?,?,?);"
+            data = [(season_id, media_type.value, weight) for media_type, weight in weights.items()]
+            self.conn.executemany(query, data)
+        return season_id
+
+    @cached('seasons')
+    def get_seasons(self, discord_guild_id):
+        query = "SELECT * FROM seasons WHERE discord_guild_id=? ORDER BY starts_at DESC;"
+        cursor = self.conn.cursor()
+        cursor.execute(query, (discord_guild_id,))
+        return cursor.fetchall()
+
+    @cached('seasons')
+    def get_season(self, discord_guild_id, season_id):
+        query = "SELECT * FROM seasons WHERE discord_guild_id=? AND id=?;"
+        cursor = self.conn.cursor()
+        cursor.execute(query, (discord_guild_id, season_id))
+        return cursor.fetchone()
+
+    @invalidates('season_standings')
+    def join_season(self, discord_guild_id, season_id, discord_user_id):
+        """Adds a member, scoring the logs they already have inside the season window."""
+        with self.conn:
+            query = "INSERT OR IGNORE INTO season_members (season_id, discord_user_id) VALUES (?,?);"
+            if not self.conn.execute(query, (season_id, discord_user_id)).rowcount:
+                return False
+            query = """
+            INSERT INTO season_standings (season_id, discord_user_id, total)
+            SELECT seasons.id, ?, (
+                SELECT TOTAL(logs.amount * season_weights.weight)
+                FROM logs
+                JOIN season_weights
+                    ON season_weights.season_id = seasons.id AND season_weights.media_type = logs.media_type
+                WHERE logs.discord_guild_id = seasons.discord_guild_id AND logs.discord_user_id = ?
+                    AND logs.created_at >= seasons.starts_at AND logs.created_at < seasons.ends_at
+            )
+            FROM seasons
+            WHERE seasons.discord_guild_id=? AND seasons.id=?;
+            """
+            data = (discord_user_id, discord_user_id, discord_guild_id, season_id)
+            self.conn.execute(query, data)
+        return True
+
+    @cached('season_standings')
+    def get_season_standings(self, discord_guild_id, season_id, limit=20):
+        query = """
+        SELECT discord_user_id, total, RANK() OVER (ORDER BY total DESC) AS rank
+        FROM season_standings
+        WHERE season_id=?
+        ORDER BY total DESC
+        LIMIT ?;
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(query, (season_id, limit))
+        return cursor.fetchall()
+
+    @cached('books', guild_scoped=False)
     def get_book(self, discord_guild_id, book_code):
         query = f"SELECT * FROM books WHERE code='{book_code}'"
         #data = (discord_guild_id, book_code)
@@ -207,26 +386,152 @@ class Store:
         cursor.execute(query)
         return cursor.fetchone()
 
+    @invalidates('books', 'activities')
     def delete_book(self, discord_guild_id, book_code):
-        query = "DELETE FROM books WHERE discord_guild_id=? AND code=?;"
-        data = (discord_guild_id, book_code)
+        with self.conn:
+            if self.journal_board_changes:
+                query = """
+                INSERT INTO board_changes (discord_guild_id, club_code)
+                SELECT discord_guild_id, club_code FROM books WHERE discord_guild_id=? AND code=?;
+                """
+                self.conn.execute(query, (discord_guild_id, book_code))
+
+            query = "DELETE FROM books WHERE discord_guild_id=? AND code=?;"
+            data = (discord_guild_id, book_code)
+            self.conn.execute(query, data)
+
+            query = "DELETE FROM activities WHERE discord_guild_id=? AND book_code=?;"
+            data = (discord_guild_id, book_code)
+            self.conn.execute(query, data)
+
+    def _journal_board_change(self, discord_guild_id, club_code):
+        """Records that club_code's board is stale, inside the caller's transaction."""
+        if not self.journal_board_changes:
+            return
+        query = "INSERT INTO board_changes (discord_guild_id, club_code) VALUES (?,?);"
+        self.conn.execute(query, (discord_guild_id, club_code))
+
+    def get_board_changes(self, after_id):
+        query = "SELECT * FROM board_changes WHERE id > ? ORDER BY id;"
+        cursor = self.conn.cursor()
+        cursor.execute(query, (after_id,))
+        return cursor.fetchall()
+
+    def delete_board_changes(self, up_to_id):
+        with self.conn:
+            query = "DELETE FROM board_changes WHERE id <= ?;"
+            return self.conn.execute(query, (up_to_id,)).rowcount
+
+    def get_snapshot_guild_ids(self):
+        query = "SELECT discord_guild_id FROM logs UNION SELECT discord_guild_id FROM books;"
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        return [row.discord_guild_id for row in cursor.fetchall()]
+
+    def get_unclosed_months(self, discord_guild_id, until_year, until_month):
+        """Months before (until_year, until_month) with data but no leaderboard snapshot yet."""
+        query = """
+        SELECT MIN(first) AS first FROM (
+            SELECT MIN(created_at) AS first FROM logs WHERE discord_guild_id=?
+            UNION ALL
+            SELECT MIN(created_at) AS first FROM books WHERE discord_guild_id=?
+        );
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(query, (discord_guild_id, discord_guild_id))
+        first = cursor.fetchone().first
+        if first is None:
+            return []
+        first_year, first_month = int(first[:4]), int(first[5:7])
+
+        query = "SELECT month FROM leaderboard_snapshot_months WHERE discord_guild_id=?;"
+        cursor.execute(query, (discord_guild_id,))
+        closed = {row.month for row in cursor.fetchall()}
+        return [
+            (year, month)
+            for year, month in common.month_year_iter(first_month, first_year, until_month, until_year)
+            if month_range(year, month)[0] not in closed
+        ]
+
+    @invalidates('leaderboard_snapshots')
+    def snapshot_month(self, discord_guild_id, year, month):
+        """Freezes the ranked standings of a finished month. Closed months are never rewritten."""
+        month_key, start, end = month_range(year, month)
+        with self.conn:
+            query = """
+            INSERT OR IGNORE INTO leaderboard_snapshot_months (discord_guild_id, month)
+            VALUES (?,?);
+            """
+            if not self.conn.execute(query, (discord_guild_id, month_key)).rowcount:
+                return False
+            for kind, source in _STANDINGS_SOURCES:
+                query = f"""
+                INSERT INTO leaderboard_snapshots (discord_guild_id, month, kind, scope, rank, discord_user_id, total)
+                SELECT ?, ?, ?, scope, rank, discord_user_id, total FROM ({_ranked(source)});
+                """
+                data = (discord_guild_id, month_key, kind, discord_guild_id, start, end)
+                self.conn.execute(query, data)
+        return True
+
+    @cached('leaderboard_snapshots')
+    def is_month_closed(self, discord_guild_id, month_key):
+        query = "SELECT 1 FROM leaderboard_snapshot_months WHERE discord_guild_id=? AND month=?;"
+        cursor = self.conn.cursor()
+        cursor.execute(query, (discord_guild_id, month_key))
+        return cursor.fetchone() is not None
+
+    @cached('leaderboard_snapshots')
+    def get_snapshot_leaderboard(self, discord_guild_id, month_key, kind, scope, limit=20):
+        query = """
+        SELECT rank, discord_user_id, total FROM leaderboard_snapshots
+        WHERE discord_guild_id=? AND month=? AND kind=? AND scope=?
+        ORDER BY rank
+        LIMIT ?;
+        """
+        data = (discord_guild_id, month_key, kind, scope, limit)
         cursor = self.conn.cursor()
         cursor.execute(query, data)
-        cursor.fetchone()
+        return cursor.fetchall()
 
-        query = "DELETE FROM activities WHERE discord_guild_id=? AND book_code=?;"
-        data = (discord_guild_id, book_code)
+    @cached('logs', 'activities', 'books')
+    def get_live_month_leaderboard(self, discord_guild_id, year, month, kind, scope, limit=20):
+        _, start, end = month_range(year, month)
+        sources = [source for source_kind, source in _STANDINGS_SOURCES if source_kind == kind]
+        # Media scopes live in different sources; 'ALL' only matches the second one.
+        query = f"""
+        SELECT rank, discord_user_id, total FROM (
+            {' UNION ALL '.join(_ranked(source) for source in sources)}
+        )
+        WHERE scope=?
+        ORDER BY rank
+        LIMIT ?;
+        """
+        data = tuple(arg for _ in sources for arg in (discord_guild_id, start, end)) + (scope, limit)
         cursor = self.conn.cursor()
         cursor.execute(query, data)
-        return cursor.fetchone()
+        return cursor.fetchall()
 
-    def get_books(self, discord_guild_id, club_code):
-        query = "SELECT * FROM books WHERE discord_guild_id=? AND club_code=? ORDER BY created_at DESC;"
-        data = (discord_guild_id, club_code)
+    @cached('books')
+    def get_books(self, discord_guild_id, club_code, limit=-1):
+        query = "SELECT * FROM books WHERE discord_guild_id=? AND club_code=? ORDER BY created_at DESC LIMIT ?;"
+        data = (discord_guild_id, club_code, limit)
         cursor = self.conn.cursor()
         cursor.execute(query, data)
         return cursor.fetchall()
 
+    def get_all_books(self):
+        query = "SELECT * FROM books ORDER BY created_at DESC;"
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        return cursor.fetchall()
+
+    def get_all_clubs(self):
+        query = "SELECT * FROM clubs;"
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        return cursor.fetchall()
+
+    @cached('activities')
     def get_activity(self, discord_guild_id, discord_user_id, book_code):
         query = """
         SELECT * FROM activities
@@ -237,6 +542,7 @@ class Store:
         cursor.execute(query, data)
         return cursor.fetchone()
 
+    @cached('activities', 'books')
     def get_activities_by_club(self, discord_guild_id, club_code):
         query = """
         SELECT activities.*, books.created_at, books.name as book_name FROM activities, books
@@ -251,6 +557,53 @@ class Store:
         cursor.execute(query, data)
         return cursor.fetchall()
 
+    @cached('activities', 'books')
+    def get_book_reader_counts(self, discord_guild_id, club_code, limit=25):
+        """Books of a club, newest first, with how many members finished each (zero included)."""
+        query = """
+        SELECT books.name AS book_name, books.code AS book_code, books.created_at, (
+            SELECT COUNT(*) FROM activities
+            WHERE activities.discord_guild_id = books.discord_guild_id
+                AND activities.club_code = books.club_code
+                AND activities.book_code = books.code
+        ) AS readers
+        FROM books
+        WHERE books.discord_guild_id=? AND books.club_code=?
+        ORDER BY books.created_at DESC
+        LIMIT ?;
+        """
+        data = (discord_guild_id, club_code, limit)
+        cursor = self.conn.cursor()
+        cursor.execute(query, data)
+        return cursor.fetchall()
+
+    @cached('activities', 'books')
+    def get_club_user_totals(self, discord_guild_id, club_code, limit=40):
+        """Top users of a club by points, with their book list (`CODE(points)`, newest first)."""
+        # GROUP_CONCAT keeps the order rows arrive in from the ordered subquery.
+        query = """
+        SELECT discord_user_id,
+            GROUP_CONCAT(book_code || '(' || printf('%g', points) || ')', ', ') AS books,
+            SUM(points) AS points
+        FROM (
+            SELECT activities.discord_user_id, activities.book_code, activities.points
+            FROM activities, books
+            WHERE activities.discord_guild_id=?
+                AND activities.club_code=?
+                AND activities.discord_guild_id = books.discord_guild_id
+                AND activities.book_code = books.code
+            ORDER BY books.created_at DESC
+        )
+        GROUP BY discord_user_id
+        ORDER BY points DESC
+        LIMIT ?;
+        """
+        data = (discord_guild_id, club_code, limit)
+        cursor = self.conn.cursor()
+        cursor.execute(query, data)
+        return cursor.fetchall()
+
+    @cached('activities', 'books')
     def get_activities_by_user(self, discord_guild_id, discord_user_id):
         query = """
         SELECT activities.*, books.created_at, books.points as book_points, books.name as book_name FROM activities, books
@@ -265,6 +618,7 @@ class Store:
         cursor.execute(query, data)
         return cursor.fetchall()
 
+    @cached('activities')
     def get_activities_by_book(self, discord_guild_id, book):
         query = "SELECT * FROM activities WHERE discord_guild_id=? AND book_code=?;"
         data = (discord_guild_id, book)
@@ -272,6 +626,7 @@ class Store:
         cursor.execute(query, data)
         return cursor.fetchall()
 
+    @cached('clubs', guild_scoped=False)
     def get_club(self, discord_guild_id, code):
         where_clause = f"""code='{code}'"""
         query = f"""SELECT * FROM clubs WHERE {where_clause}"""
@@ -280,23 +635,26 @@ class Store:
         cursor.execute(query)
         return cursor.fetchall()[0]
 
-    def get_scoreboard(self, discord_guild_id, club_code):
+    @cached('activities')
+    def get_scoreboard(self, discord_guild_id, club_code, limit=-1):
         if club_code:
             if club_code == "VN":
                 query = """
             SELECT discord_user_id, SUM(points) as points FROM activities
             WHERE discord_guild_id=? AND club_code=?
             GROUP BY discord_user_id
-            ORDER BY points DESC;
+            ORDER BY points DESC
+            LIMIT ?;
             """
             else:
                 query = """
                 SELECT discord_user_id, SUM(points) as points FROM activities
                 WHERE discord_guild_id=? AND club_code=? AND NOT club_code='VN'
                 GROUP BY discord_user_id
-                ORDER BY points DESC;
+                ORDER BY points DESC
+                LIMIT ?;
                 """
-            data = (discord_guild_id, club_code)
+            data = (discord_guild_id, club_code, limit)
             cursor = self.conn.cursor()
             cursor.execute(query, data)
             return cursor.fetchall()
@@ -305,25 +663,85 @@ class Store:
             SELECT discord_user_id, SUM(points) as points FROM activities
             WHERE discord_guild_id=? AND NOT club_code='VN'
             GROUP BY discord_user_id
-            ORDER BY points DESC;
+            ORDER BY points DESC
+            LIMIT ?;
             """
-            data = (discord_guild_id,)
+            data = (discord_guild_id, limit)
             cursor = self.conn.cursor()
             cursor.execute(query, data)
             return cursor.fetchall()
 
+    # Not cached: it has to notice writes made by other processes while the bot was offline.
+    def get_board_fingerprint(self, discord_guild_id, club_code):
+        """The exact rows a club board renders, used to skip unchanged boards.
+
+        Reads the same top 10 scoreboard and 50 past books as boards.publish_board,
+        bypassing the query cache.
+        """
+        scoreboard = Store.get_scoreboard.__wrapped__(self, discord_guild_id, club_code, limit=10)
+        books = None
+        if club_code:
+            books = Store.get_books.__wrapped__(self, discord_guild_id, club_code, limit=50)
+        return tuple(scoreboard), tuple(books) if books is not None else None
+
 
 def init_tables(db_name):
     conn = sqlite3.connect(db_name)
+    # WAL lets board_publisher.py read while the bot writes.
+    conn.execute('PRAGMA journal_mode=WAL;')
     with conn:
         conn.execute(_CREATE_CLUBS_TABLE)
         conn.execute(_CREATE_BOOKS_TABLE)
         conn.execute(_CREATE_ACTIVITIES_TABLE)
+        conn.execute(_CREATE_BOARD_CHANGES_TABLE)
+        conn.execute(_CREATE_LEADERBOARD_SNAPSHOTS_TABLE)
+        conn.execute(_CREATE_LEADERBOARD_SNAPSHOT_MONTHS_TABLE)
+        conn.execute(_CREATE_SEASONS_TABLE)
+        conn.execute(_CREATE_SEASONS_INDEX)
+        conn.execute(_CREATE_SEASON_WEIGHTS_TABLE)
+        conn.execute(_CREATE_SEASON_MEMBERS_TABLE)
+        conn.execute(_CREATE_SEASON_STANDINGS_TABLE)
+        conn.execute(_CREATE_SEASON_STANDINGS_INDEX)
         conn.execute(_CREATE_LOG_TABLE)
+    _migrate_logs_id(conn)
+    with conn:
         conn.execute(_CREATE_LOG_TABLE_INDEX)
+        conn.execute(_CREATE_LOG_USER_INDEX)
+        conn.execute(_CREATE_BOOKS_CLUB_INDEX)
+        conn.execute(_CREATE_ACTIVITIES_CLUB_USER_INDEX)
     return
 
 
+def _migrate_logs_id(conn):
+    """Rebuilds a logs table created before it had an id primary key.
+
+    The rename, create, copy and drop run in one explicit transaction (sqlite
+    DDL is transactional), so an interrupted migration leaves the old table as
+    it was.
+    """
+    leftover = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'logs_old';").fetchone()
+    if leftover:
+        raise RuntimeError('logs_old exists, an earlier logs migration did not finish; '
+                           'check it against logs and drop it before starting the bot')
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(logs);')]
+    if 'id' in columns:
+        return
+    conn.execute('BEGIN;')
+    try:
+        conn.execute('ALTER TABLE logs RENAME TO logs_old;')
+        conn.execute(_CREATE_LOG_TABLE)
+        conn.execute("""
+        INSERT INTO logs (discord_guild_id, discord_user_id, media_type, amount, note, created_at)
+        SELECT discord_guild_id, discord_user_id, media_type, amount, note, created_at FROM logs_old
+        ORDER BY created_at, rowid;
+        """)
+        conn.execute('DROP TABLE logs_old;')
+        conn.execute('COMMIT;')
+    except BaseException:
+        conn.execute('ROLLBACK;')
+        raise
+
+
 _CREATE_CLUBS_TABLE = """
 CREATE TABLE IF NOT EXISTS clubs (
     discord_guild_id INTEGER,
@@ -349,6 +767,7 @@ _CREATE_ACTIVITIES_TABLE = """
 CREATE TABLE IF NOT EXISTS activities (
     discord_guild_id INTEGER,
     book_code TEXT,
+    club_code TEXT,
     discord_user_id INTEGER,
     points REAL,
     FOREIGN KEY (discord_guild_id, book_code) REFERENCES books(discord_guild_id, code),
@@ -357,9 +776,99 @@ CREATE TABLE IF NOT EXISTS activities (
 );
 """
 
+# Covers get_books and the book side of get_book_reader_counts.
+_CREATE_BOOKS_CLUB_INDEX = """
+CREATE INDEX IF NOT EXISTS books_club_idx ON books (discord_guild_id, club_code, created_at);
+"""
+
+# Covers get_club_user_totals and get_scoreboard without touching the table.
+_CREATE_ACTIVITIES_CLUB_USER_INDEX = """
+CREATE INDEX IF NOT EXISTS activities_club_user_idx ON activities (discord_guild_id, club_code, discord_user_id, book_code, points);
+"""
+
+# Journal of boards made stale by Store writes, consumed by board_publisher.py.
+_CREATE_BOARD_CHANGES_TABLE = """
+CREATE TABLE IF NOT EXISTS board_changes (
+    id INTEGER PRIMARY KEY,
+    discord_guild_id INTEGER,
+    club_code TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Frozen month-end standings. kind is 'media' (scope is a media type or ALL) or 'club'.
+_CREATE_LEADERBOARD_SNAPSHOTS_TABLE = """
+CREATE TABLE IF NOT EXISTS leaderboard_snapshots (
+    discord_guild_id INTEGER,
+    month TEXT,
+    kind TEXT,
+    scope TEXT,
+    rank INTEGER,
+    discord_user_id INTEGER,
+    total REAL,
+    PRIMARY KEY (discord_guild_id, month, kind, scope, rank, discord_user_id)
+);
+"""
+
+_CREATE_LEADERBOARD_SNAPSHOT_MONTHS_TABLE = """
+CREATE TABLE IF NOT EXISTS leaderboard_snapshot_months (
+    discord_guild_id INTEGER,
+    month TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (discord_guild_id, month)
+);
+"""
+
+# Time-boxed reading events. Standings are kept up to date by the log write methods.
+_CREATE_SEASONS_TABLE = """
+CREATE TABLE IF NOT EXISTS seasons (
+    id INTEGER PRIMARY KEY,
+    discord_guild_id INTEGER,
+    name TEXT,
+    starts_at TIMESTAMP,
+    ends_at TIMESTAMP
+);
+"""
+
+_CREATE_SEASONS_INDEX = """
+CREATE INDEX IF NOT EXISTS seasons_guild_ends_at_idx ON seasons (discord_guild_id, ends_at);
+"""
+
+_CREATE_SEASON_WEIGHTS_TABLE = """
+CREATE TABLE IF NOT EXISTS season_weights (
+    season_id INTEGER,
+    media_type TEXT,
+    weight REAL,
+    PRIMARY KEY (season_id, media_type)
+);
+"""
+
+_CREATE_SEASON_MEMBERS_TABLE = """
+CREATE TABLE IF NOT EXISTS season_members (
+    season_id INTEGER,
+    discord_user_id INTEGER,
+    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (season_id, discord_user_id)
+);
+"""
+
+_CREATE_SEASON_STANDINGS_TABLE = """
+CREATE TABLE IF NOT EXISTS season_standings (
+    season_id INTEGER,
+    discord_user_id INTEGER,
+    total REAL,
+    PRIMARY KEY (season_id, discord_user_id)
+);
+"""
+
+_CREATE_SEASON_STANDINGS_INDEX = """
+CREATE INDEX IF NOT EXISTS season_standings_total_idx ON season_standings (season_id, total);
+"""
+
 
 _CREATE_LOG_TABLE = """
 CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
     discord_guild_id INTEGER,
     discord_user_id INTEGER,
     media_type TEXT,
@@ -373,6 +882,10 @@ _CREATE_LOG_TABLE_INDEX = """
 CREATE INDEX IF NOT EXISTS discord_guild_id_over_created_at_idx ON logs (discord_guild_id, created_at);
 """
 
+_CREATE_LOG_USER_INDEX = """
+CREATE INDEX IF NOT EXISTS logs_user_idx ON logs (discord_guild_id, discord_user_id, created_at);
+"""
+
 _CREATE_WAIFU_TABLE = """
 CREATE TABLE IF NOT EXISTS waifus (
     id INTEGER PRIMARY KEY,
@@ -0,0 +1,103 @@
+"""Event loop lag watchdog.
+
+A heartbeat task wakes up every `interval` (well below `threshold`) and
+measures how late the loop woke it, so any callback blocking for longer than
+the threshold delays a beat by at least that much. A separate thread watches
+the beats and, as soon as one is overdue by more than the threshold, samples
+the loop thread's stack so we can see which command or Store method was
+blocking it.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+Incident = namedtuple('Incident', ['started_at', 'lag', 'stack'])
+
+
+def _project_frames(frame, limit):
+    """The innermost `limit` frames from this repo, falling back to the raw stack."""
+    stack = traceback.extract_stack(frame)
+    own = [f for f in stack if os.path.abspath(f.filename).startswith(_PROJECT_DIR)]
+    frames = (own or stack)[-limit:]
+    return [f'{os.path.basename(f.filename)}:{f.lineno} {f.name}' for f in frames]
+
+
+class LoopWatchdog:
+    def __init__(self, interval=0.05, threshold=0.25, max_incidents=20, stack_depth=6):
+        if interval >= threshold:
+            raise ValueError('interval has to be below threshold to catch every blocking callback')
+        self.interval = interval
+        self.threshold = threshold
+        self.stack_depth = stack_depth
+        self.incidents = deque(maxlen=max_incidents)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self._last_beat = time.monotonic()
+        self._beat = 0
+        self._sampled_beat = None
+        self._pending_stack = None
+        self._loop_thread_id = None
+        self._task = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Starts watching the running event loop."""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+
+    def stats(self):
+        return {
+            'samples': self.samples,
+            'max_lag': self.max_lag,
+            'avg_lag': self.total_lag / self.samples if self.samples else 0.0,
+            'incidents': len(self.incidents),
+        }
+
+    async def _heartbeat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - before - self.interval)
+            self._last_beat = now
+            self._beat += 1
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            # A block can start up to one interval into a sleep, hiding that much of it from lag.
+            if lag > self.threshold - self.interval:
+                stack = self._pending_stack or ['<no sample captured>']
+                self._pending_stack = None
+                incident = Incident(datetime.now() - timedelta(seconds=lag), lag, stack)
+                self.incidents.append(incident)
+                logger.warning('Event loop blocked for %.3fs in %s', lag, ' <- '.join(reversed(stack)))
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 4):
+            overdue = time.monotonic() - self._last_beat
+            if overdue <= self.threshold or self._sampled_beat == self._beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            # One sample per stall, taken while the blocking code is still running.
+            self._sampled_beat = self._beat
+            self._pending_stack = _project_frames(frame, self.stack_depth)
@@ -0,0 +1,137 @@
+"""Result cache for Store read methods.
+
+Entries are keyed by method name and arguments and tagged with the
+(table, guild) pairs they read. Store write methods invalidate the tags they
+touch, so a write to one guild's activities leaves its books and the other
+guilds' results cached.
+"""
+import functools
+import sys
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+# Tag guild for queries that are not scoped to a guild, invalidated by writes to any guild.
+ANY_GUILD = None
+
+_MISSING = object()
+_Entry = namedtuple('_Entry', ['value', 'size', 'tags', 'expires_at'])
+
+
+def _sizeof(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(_sizeof(v) for v in value)
+    return size
+
+
+class QueryCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._keys_by_tag = defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at and entry.expires_at < time.monotonic():
+            self._discard(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return _MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def put(self, key, value, tags, ttl=None):
+        size = _sizeof(value)
+        if key in self._entries:
+            self._discard(key)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._entries[key] = _Entry(value, size, tags, expires_at)
+        self.size += size
+        for tag in tags:
+            self._keys_by_tag[tag].add(key)
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            self.evictions += 1
+
+    def invalidate(self, table, discord_guild_id):
+        keys = self._keys_by_tag.pop((table, discord_guild_id), set())
+        keys |= self._keys_by_tag.pop((table, ANY_GUILD), set())
+        for key in keys:
+            if key in self._entries:
+                self._discard(key)
+                self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_tag.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+        }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+        for tag in entry.tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+def cached(*tables, guild_scoped=True, ttl=None):
+    """Caches a Store read method whose first argument is the guild id.
+
+    Queries that ignore the guild (or read time-dependent data) should pass
+    guild_scoped=False or a ttl respectively.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+            result = self.cache.get(key)
+            if result is not _MISSING:
+                return result
+            result = fn(self, *args, **kwargs)
+            guild = args[0] if guild_scoped and args else ANY_GUILD
+            self.cache.put(key, result, {(table, guild) for table in tables}, ttl)
+            return result
+        return wrapper
+    return decorator
+
+
+def invalidates(*tables):
+    """Marks a Store write method, its first argument being the guild id written to."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, discord_guild_id, *args, **kwargs):
+            try:
+                return fn(self, discord_guild_id, *args, **kwargs)
+            finally:
+                for table in tables:
+                    self.cache.invalidate(table, discord_guild_id)
+        return wrapper
+    return decorator